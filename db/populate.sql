@@ -30,6 +30,36 @@ VALUES
   ('Assigned'),
   ('In Progress');
 
+-- Status-specific partial indexes (status ids are only known once seeded)
+DO $$
+DECLARE
+    v_pending_id INT;
+    v_active_ids TEXT;
+BEGIN
+    SELECT assignment_status_id INTO v_pending_id
+    FROM lead_management.assignment_statuses
+    WHERE name = 'Pending';
+
+    SELECT string_agg(assignment_status_id::text, ', ') INTO v_active_ids
+    FROM lead_management.assignment_statuses
+    WHERE name IN ('Assigned', 'In Progress');
+
+    EXECUTE format(
+        'CREATE INDEX ix_assignment_pending_lead
+           ON lead_management.assignments (lead_document_number)
+           WHERE assignment_status_id = %s',
+        v_pending_id
+    );
+
+    EXECUTE format(
+        'CREATE INDEX ix_assignment_active_seller
+           ON lead_management.assignments (seller_document_number)
+           WHERE assignment_status_id IN (%s)',
+        v_active_ids
+    );
+END;
+$$;
+
 -- Sellers (seed a few so assignments can be tested)
 INSERT INTO lead_management.sellers (
     document_number, given_name, surname, phone, email,
@@ -1,5 +1,7 @@
 CREATE SCHEMA lead_management;
 
+CREATE EXTENSION IF NOT EXISTS citext;
+
 CREATE TABLE lead_management.audit_logs (
   audit_log_id SERIAL,
   table_name VARCHAR(25),
@@ -29,7 +31,7 @@ CREATE TABLE lead_management.business_lines (
 
 CREATE TABLE lead_management.assignment_statuses (
   assignment_status_id SERIAL,
-  name VARCHAR(100)
+  name CITEXT
 );
 
 CREATE TABLE lead_management.leads (
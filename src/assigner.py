@@ -1,22 +1,35 @@
-import psycopg2
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from psycopg2.extras import DictCursor
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
 import os
-from datetime import datetime
+import atexit
 import logging
+import queue
+import weakref
+from logging.handlers import QueueHandler, QueueListener
 
 # --- Logging setup ---
 LOG_DIR = "logs"
 os.makedirs(LOG_DIR, exist_ok=True)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(LOG_DIR, "lead_assigner.log")),
-        logging.StreamHandler()
-    ]
-)
+# Loggers only enqueue records; a background listener does the file/console I/O.
+log_queue = queue.Queue(-1)
+log_formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
+log_handlers = [
+    logging.FileHandler(os.path.join(LOG_DIR, "lead_assigner.log")),
+    logging.StreamHandler()
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+
+log_listener = QueueListener(log_queue, *log_handlers)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(QueueHandler(log_queue))
 logger = logging.getLogger(__name__)
 
 # --- DB Config ---
@@ -29,34 +42,93 @@ DB_CONFIG = {
     "password": os.getenv('POSTGRES_PASSWORD')
 }
 
+# Two connections stay open: one for the simulator loop and one for the
+# background assigner, so overlapping runs never close a pooled connection.
+POOL = ThreadedConnectionPool(minconn=2, maxconn=8, **DB_CONFIG)
+
+@contextmanager
 def get_connection():
-    """Returns a new database connection."""
-    return psycopg2.connect(**DB_CONFIG)
+    """Borrows a connection from the pool.
+    The block runs as one explicit transaction: it commits on success, rolls
+    back on error and always returns the connection to the pool.
+    """
+    conn = POOL.getconn()
+    conn.autocommit = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        # A dropped connection cannot roll back; keep the original error.
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        POOL.putconn(conn)
+
+# --- Prepared statements ---
+# Names of the statements already prepared on each pooled connection.
+_PREPARED = weakref.WeakKeyDictionary()
+
+def execute_prepared(cursor, name, statement, params=()):
+    """Executes a statement through a server-side prepared statement.
+    The statement (with $1, $2, ... placeholders) is prepared the first time
+    it runs on a connection and reused by name afterwards.
+    """
+    prepared = _PREPARED.setdefault(cursor.connection, set())
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} AS {statement}")
+        prepared.add(name)
+
+    if params:
+        placeholders = ", ".join(["%s"] * len(params))
+        cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
 
 # --- Assignment helpers ---
-def get_status_id(cursor, status_name):
+# Status ids never change once created, so they are looked up once per process.
+# A missing status is cached as None until get_status_id creates it.
+_STATUS_CACHE = {}
+
+def find_status_id(cursor, status_name):
     """Fetches the assignment_status_id for a given status name.
-    If not found, inserts it and returns the new id.
+    Returns None if the status does not exist; the miss is cached as well.
     """
     clean_name = status_name.strip()
+    cache_key = clean_name.lower()
+    if cache_key in _STATUS_CACHE:
+        return _STATUS_CACHE[cache_key]
+
     cursor.execute("""
         SELECT assignment_status_id
         FROM lead_management.assignment_statuses
-        WHERE LOWER(name) = LOWER(%s)
+        WHERE name = %s
     """, (clean_name,))
     row = cursor.fetchone()
 
-    if row:
-        return row['assignment_status_id']
+    _STATUS_CACHE[cache_key] = row[0] if row else None
+    return _STATUS_CACHE[cache_key]
+
+def get_status_id(cursor, status_name):
+    """Fetches the assignment_status_id for a given status name.
+    If not found, inserts it and returns the new id.
+    """
+    status_id = find_status_id(cursor, status_name)
+    if status_id is not None:
+        return status_id
 
+    clean_name = status_name.strip()
+    # Forget the cached miss; the new id is cached by the next lookup once
+    # committed, so a rolled-back insert never leaves a dangling id behind.
+    _STATUS_CACHE.pop(clean_name.lower(), None)
     cursor.execute("""
         INSERT INTO lead_management.assignment_statuses (name)
         VALUES (%s)
         RETURNING assignment_status_id
     """, (clean_name,))
-    new_row = cursor.fetchone()
-    logger.info(f"Inserted new assignment status '{clean_name}' with id {new_row['assignment_status_id']}.")
-    return new_row['assignment_status_id']
+    new_id = cursor.fetchone()[0]
+    logger.info(f"Inserted new assignment status '{clean_name}' with id {new_id}.")
+    return new_id
 
 def ensure_pending_assignments(cursor):
     """
@@ -65,142 +137,126 @@ def ensure_pending_assignments(cursor):
     """
     pending_id = get_status_id(cursor, "Pending")
 
-    cursor.execute("""
-        SELECT l.document_number
+    execute_prepared(cursor, "ensure_pending_assignments", """
+        INSERT INTO lead_management.assignments
+        (assigned_at, seller_document_number, lead_document_number, assignment_status_id)
+        SELECT NOW(), NULL, l.document_number, $1::int
         FROM lead_management.leads l
         LEFT JOIN lead_management.assignments a
           ON l.document_number = a.lead_document_number
         WHERE a.lead_document_number IS NULL
-    """)
-    new_leads = cursor.fetchall()
-
-    if new_leads:
-        to_insert = [
-            (datetime.now(), None, lead['document_number'], pending_id)
-            for lead in new_leads
-        ]
-        cursor.executemany("""
-            INSERT INTO lead_management.assignments
-            (assigned_at, seller_document_number, lead_document_number, assignment_status_id)
-            VALUES (%s, %s, %s, %s)
-        """, to_insert)
-        logger.info(f"Inserted {len(to_insert)} new leads into assignments as Pending.")
-
-# --- Fetchers ---
-def fetch_pending_leads(cursor):
-    """Fetches leads that are in Pending status."""
-    cursor.execute("""
-        SELECT l.document_number, l.business_line_id
-        FROM lead_management.leads l
-        JOIN lead_management.assignments a
-          ON l.document_number = a.lead_document_number
-        JOIN lead_management.assignment_statuses st
-          ON a.assignment_status_id = st.assignment_status_id
-        WHERE LOWER(st.name) = 'pending'
-        ORDER BY l.document_number
-    """)
-    leads = cursor.fetchall()
-    logger.info(f"Fetched {len(leads)} pending leads.")
-    return leads
-
-def fetch_eligible_sellers(cursor):
-    """Fetches active sellers with their current number of assigned leads."""
-    cursor.execute("""
-        SELECT
-            s.document_number,
-            s.business_line_id,
-            s.max_leads_count,
-            COALESCE((
-                SELECT COUNT(*)
-                FROM lead_management.assignments a
-                JOIN lead_management.assignment_statuses st
-                    ON a.assignment_status_id = st.assignment_status_id
-                WHERE a.seller_document_number = s.document_number
-                  AND st.name IN ('Assigned', 'In Progress')
-            ), 0) AS current_leads
-        FROM lead_management.sellers s
-        WHERE s.is_active = TRUE
-    """)
-    sellers = cursor.fetchall()
-    logger.info(f"Fetched {len(sellers)} eligible sellers.")
-    return sellers
+    """, (pending_id,))
+
+    if cursor.rowcount:
+        logger.info(f"Inserted {cursor.rowcount} new leads into assignments as Pending.")
 
 # --- Assignment logic ---
-def is_lead_assignable(lead, seller):
-    """Checks if a lead can be assigned to a specific seller."""
-    if lead["business_line_id"] != seller["business_line_id"]:
-        return False
-    if seller["current_leads"] >= seller["max_leads_count"]:
-        return False
-    return True
-
-def assign_leads_to_sellers(cursor, leads, sellers):
-    """Assigns pending leads to sellers (updates existing assignments)."""
-    assigned_count = 0
+def assign_leads_to_sellers(cursor):
+    """Assigns pending leads to sellers (updates existing assignments).
+
+    The whole greedy match runs server-side in a single UPDATE: pending leads
+    are numbered per business line in document order, every free seat of an
+    active seller is numbered per business line in seller order, and lead N
+    of a line takes seat N of the same line.
+    """
     assigned_id = get_status_id(cursor, "Assigned")
+    pending_id = get_status_id(cursor, "Pending")
+    # Only counted towards seller workload if it exists; never created here.
+    in_progress_id = find_status_id(cursor, "In Progress")
+    active_ids = [assigned_id] if in_progress_id is None else [assigned_id, in_progress_id]
 
-    for lead in leads:
-        eligible = [s for s in sellers if is_lead_assignable(lead, s)]
-        if eligible:
-            seller = eligible[0]
-            cursor.execute("""
-                UPDATE lead_management.assignments
-                SET seller_document_number = %s,
-                    assignment_status_id = %s,
-                    assigned_at = %s
-                WHERE lead_document_number = %s
-            """, (
-                seller['document_number'],
-                assigned_id,
-                datetime.now(),
-                lead['document_number']
-            ))
-            seller['current_leads'] += 1
-            assigned_count += 1
-            logger.info(f"Assigned lead {lead['document_number']} to seller {seller['document_number']}.")
+    # The status ids are inlined as literals rather than passed as $n
+    # parameters: a generic plan cannot match a parameter against the
+    # partial-index predicates on assignments. The ids are part of the
+    # statement name so a changed set of statuses gets its own statement.
+    name = "assign_leads_to_sellers_" + "_".join(str(i) for i in [pending_id, *active_ids])
+    statement = sql.SQL("""
+        UPDATE lead_management.assignments a
+        SET seller_document_number = m.seller_document_number,
+            assignment_status_id = {assigned_id},
+            assigned_at = NOW()
+        FROM (
+            WITH pending_leads AS (
+                SELECT
+                    l.document_number,
+                    l.business_line_id,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY l.business_line_id
+                        ORDER BY l.document_number
+                    ) AS rn
+                FROM lead_management.leads l
+                JOIN lead_management.assignments pa
+                  ON l.document_number = pa.lead_document_number
+                WHERE pa.assignment_status_id = {pending_id}
+            ),
+            eligible_sellers AS (
+                SELECT
+                    s.document_number,
+                    s.business_line_id,
+                    s.max_leads_count,
+                    COALESCE(c.cnt, 0) AS current_leads
+                FROM lead_management.sellers s
+                LEFT JOIN (
+                    SELECT sa.seller_document_number, COUNT(*) AS cnt
+                    FROM lead_management.assignments sa
+                    WHERE sa.assignment_status_id IN ({active_ids})
+                    GROUP BY sa.seller_document_number
+                ) c ON c.seller_document_number = s.document_number
+                WHERE s.is_active = TRUE
+            ),
+            seller_slots AS (
+                SELECT
+                    es.document_number,
+                    es.business_line_id,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY es.business_line_id
+                        ORDER BY es.document_number, slot
+                    ) AS rn
+                FROM eligible_sellers es
+                CROSS JOIN LATERAL generate_series(1, es.max_leads_count - es.current_leads) AS slot
+            )
+            SELECT
+                pl.document_number AS lead_document_number,
+                ss.document_number AS seller_document_number
+            FROM pending_leads pl
+            JOIN seller_slots ss
+              ON pl.business_line_id = ss.business_line_id
+             AND pl.rn = ss.rn
+        ) m
+        WHERE a.lead_document_number = m.lead_document_number
+          AND a.assignment_status_id = {pending_id}
+        RETURNING a.lead_document_number, a.seller_document_number
+    """).format(
+        assigned_id=sql.Literal(assigned_id),
+        pending_id=sql.Literal(pending_id),
+        active_ids=sql.SQL(", ").join(sql.Literal(i) for i in active_ids),
+    )
+    execute_prepared(cursor, name, statement.as_string(cursor))
 
-    return assigned_count
+    rows = cursor.fetchall()
+    for lead_document_number, seller_document_number in rows:
+        logger.debug("Assigned lead %s to seller %s.", lead_document_number, seller_document_number)
+    return len(rows)
 
 # --- Main ---
 def assign_leads():
-    """Main function: fetches leads and sellers, performs assignment."""
+    """Main function: ensures pending assignments, performs assignment."""
     assigned_count = 0
     try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Paso 1: asegurar que todo lead tiene assignment
-        ensure_pending_assignments(cursor)
-        conn.commit()
-
-        # Paso 2: traer leads pendientes
-        leads = fetch_pending_leads(cursor)
-        if not leads:
-            logger.info("No pending leads.")
-            return assigned_count
+        with get_connection() as conn, conn.cursor() as cursor:
+            # Paso 1: asegurar que todo lead tiene assignment
+            ensure_pending_assignments(cursor)
 
-        # Paso 3: traer vendedores
-        sellers = fetch_eligible_sellers(cursor)
-        if not sellers:
-            logger.info("No eligible sellers.")
-            return assigned_count
-
-        # Paso 4: asignar leads
-        assigned_count = assign_leads_to_sellers(cursor, leads, sellers)
-        conn.commit()
+            # Paso 2: asignar leads pendientes a vendedores con cupo
+            assigned_count = assign_leads_to_sellers(cursor)
 
         logger.info(f"{assigned_count} leads have been assigned successfully.")
 
     except Exception as e:
         logger.error(f"Error assigning leads: {e}")
 
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
-
     return assigned_count
 
 if __name__ == "__main__":
     assign_leads()
+    POOL.closeall()
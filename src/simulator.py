@@ -1,9 +1,12 @@
+import io
 import os
+import csv
 import time
 import signal
 import random
-import psycopg2
-from psycopg2.extras import DictCursor
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2 import sql
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 import assigner
 from assigner import logger
@@ -11,76 +14,146 @@ from assigner import logger
 # --- Load configuration from .env ---
 load_dotenv()
 
-DB_CONFIG = {
-    "host": os.getenv("POSTGRES_HOST"),
-    "port": os.getenv("POSTGRES_PORT"),
-    "database": os.getenv("POSTGRES_DB"),
-    "user": os.getenv("POSTGRES_USER"),
-    "password": os.getenv("POSTGRES_PASSWORD"),
-}
-
 # Simulation parameters
 SIMULATION_INTERVAL = int(os.getenv("SIMULATION_INTERVAL", 30))
 LEADS_MIN = int(os.getenv("LEADS_MIN", 1))
 LEADS_MAX = int(os.getenv("LEADS_MAX", 5))
+COPY_THRESHOLD = int(os.getenv("COPY_THRESHOLD", 1000))
+
+# Status given to every newly inserted lead
+INITIAL_ASSIGNMENT_STATUS = "Pending"
+
+# Fake lead attributes
+GIVEN_NAMES = ["Juan", "Maria", "Pedro", "Ana", "Luis", "Sofia", "Carlos"]
+SURNAMES = ["Gomez", "Perez", "Martinez", "Lopez", "Rodriguez", "Mendez"]
+DOCUMENT_NUMBERS = range(100000000, 9999999999 + 1)
+PHONE_NUMBERS = range(3000000000, 3999999999 + 1)
+EMAIL_SUFFIXES = range(1, 1000)
 
-# --- Database connection ---
-def get_connection():
-    return psycopg2.connect(**DB_CONFIG)
+LEAD_COLUMNS = (
+    "document_number, given_name, surname, phone, email, "
+    "business_line_id, country_id, document_type_id"
+)
 
 # --- Helpers ---
-def pick_random_id(cursor, table, id_col):
-    cursor.execute(f"SELECT {id_col} FROM lead_management.{table} ORDER BY RANDOM() LIMIT 1")
-    return cursor.fetchone()[0]
-
-def generate_fake_lead(cursor, i):
-    """Generate a lead with valid foreign key references."""
-    business_line_id = pick_random_id(cursor, "business_lines", "business_line_id")
-    country_id = pick_random_id(cursor, "countries", "country_id")
-    document_type_id = pick_random_id(cursor, "document_types", "document_type_id")
-
-    doc_num = str(random.randint(100000000, 9999999999))
-    given_name = random.choice(["Juan", "Maria", "Pedro", "Ana", "Luis", "Sofia", "Carlos"])
-    surname = random.choice(["Gomez", "Perez", "Martinez", "Lopez", "Rodriguez", "Mendez"])
-    phone = f"+57{random.randint(3000000000, 3999999999)}"
-    email = f"{given_name.lower()}.{surname.lower()}{random.randint(1,999)}@example.com"
-
-    return (
-        doc_num,
-        given_name,
-        surname,
-        phone,
-        email,
-        business_line_id,
-        country_id,
-        document_type_id,
+def fetch_reference_ids(cursor):
+    """Fetch every valid foreign key id in a single query so leads can pick them locally.
+    Returns the business line, country and document type id lists.
+    """
+    assigner.execute_prepared(cursor, "fetch_reference_ids", """
+        SELECT
+            ARRAY(SELECT business_line_id FROM lead_management.business_lines),
+            ARRAY(SELECT country_id FROM lead_management.countries),
+            ARRAY(SELECT document_type_id FROM lead_management.document_types)
+    """)
+    return cursor.fetchone()
+
+def generate_fake_leads(n, business_line_ids, country_ids, document_type_ids):
+    """Generate a batch of n leads with valid foreign key references.
+
+    Every column is drawn for the whole batch at once with random.choices
+    and the rows are assembled with zip.
+    """
+    columns = zip(
+        random.choices(DOCUMENT_NUMBERS, k=n),
+        random.choices(GIVEN_NAMES, k=n),
+        random.choices(SURNAMES, k=n),
+        random.choices(PHONE_NUMBERS, k=n),
+        random.choices(EMAIL_SUFFIXES, k=n),
+        random.choices(business_line_ids, k=n),
+        random.choices(country_ids, k=n),
+        random.choices(document_type_ids, k=n),
+    )
+
+    return [
+        (
+            str(doc_num),
+            given_name,
+            surname,
+            f"+57{phone}",
+            f"{given_name.lower()}.{surname.lower()}{suffix}@example.com",
+            business_line_id,
+            country_id,
+            document_type_id,
+        )
+        for (
+            doc_num, given_name, surname, phone, suffix,
+            business_line_id, country_id, document_type_id,
+        ) in columns
+    ]
+
+def copy_leads_to_staging(cursor, leads):
+    """Bulk-load leads into a transaction-scoped staging table with COPY.
+
+    COPY cannot skip conflicting rows, so leads are staged first and moved
+    into lead_management.leads with ON CONFLICT DO NOTHING, which skips
+    duplicates on either unique key (document_number or email).
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(leads)
+    buffer.seek(0)
+
+    cursor.execute("""
+        CREATE TEMP TABLE lead_staging
+        (LIKE lead_management.leads)
+        ON COMMIT DROP
+    """)
+    cursor.copy_expert(
+        f"COPY lead_staging ({LEAD_COLUMNS}) FROM STDIN WITH CSV", buffer
     )
 
-def insert_lead(cursor, lead):
-    """Insert a lead without creating an assignment."""
-    cursor.execute(
+def insert_leads(cursor, leads, status_id):
+    """Insert a batch of leads with their initial assignments in one statement.
+
+    The lead INSERT runs as a data-modifying CTE feeding the assignments
+    INSERT, so the whole batch costs a single round-trip. Batches of at
+    least COPY_THRESHOLD leads are loaded with COPY through a staging table
+    instead of a VALUES list. Returns the document numbers actually inserted.
+    """
+    use_copy = len(leads) >= COPY_THRESHOLD
+    if use_copy:
+        copy_leads_to_staging(cursor, leads)
+        source = sql.SQL(f"SELECT {LEAD_COLUMNS} FROM lead_staging")
+    else:
+        source = sql.SQL("VALUES %s")
+
+    query = sql.SQL(
         """
-        INSERT INTO lead_management.leads (
-            document_number, given_name, surname, phone, email,
-            business_line_id, country_id, document_type_id
+        WITH new_leads AS (
+            INSERT INTO lead_management.leads ({columns})
+            {source}
+            ON CONFLICT DO NOTHING
+            RETURNING document_number
         )
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-        ON CONFLICT (document_number) DO NOTHING
-        RETURNING document_number
-        """,
-        lead,
+        INSERT INTO lead_management.assignments
+        (assigned_at, seller_document_number, lead_document_number, assignment_status_id)
+        SELECT NOW(), NULL, document_number, {status_id}
+        FROM new_leads
+        RETURNING lead_document_number
+        """
+    ).format(
+        columns=sql.SQL(LEAD_COLUMNS),
+        source=source,
+        status_id=sql.Literal(status_id),
     )
-    row = cursor.fetchone()
-    if row:
-        logger.info(f"Lead {row[0]} inserted.")
+    if use_copy:
+        cursor.execute(query)
+        rows = cursor.fetchall()
     else:
-        logger.warning(f"Lead {lead[0]} already exists, skipping.")
+        rows = execute_values(cursor, query, leads, page_size=1000, fetch=True)
+
+    inserted = [row[0] for row in rows]
+    inserted_set = set(inserted)
+    for lead in leads:
+        if lead[0] in inserted_set:
+            logger.debug("Lead %s inserted.", lead[0])
+        else:
+            logger.warning("Lead %s skipped: document number or email already exists.", lead[0])
+    logger.info(f"Inserted {len(inserted)} of {len(leads)} leads.")
+    return inserted
 
 def run_simulation_cycle(cycle_num):
     try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
         lead_range = list(range(LEADS_MIN, LEADS_MAX + 1))
 
         default_weights = {
@@ -100,16 +173,14 @@ def run_simulation_cycle(cycle_num):
 
         logger.info(f"Generating {n_leads} leads in cycle {cycle_num}.")
 
-        for i in range(n_leads):
-            lead = generate_fake_lead(cursor, f"{cycle_num}_{i}")
-            insert_lead(cursor, lead)
-
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with assigner.get_connection() as conn, conn.cursor() as cursor:
+            business_line_ids, country_ids, document_type_ids = fetch_reference_ids(cursor)
+            status_id = assigner.get_status_id(cursor, INITIAL_ASSIGNMENT_STATUS)
 
-        # Call assigner to handle assignments
-        assigner.assign_leads()
+            leads_batch = generate_fake_leads(
+                n_leads, business_line_ids, country_ids, document_type_ids
+            )
+            insert_leads(cursor, leads_batch, status_id)
 
     except Exception as e:
         logger.error(f"Error in simulation cycle {cycle_num}: {e}")
@@ -128,12 +199,19 @@ def main():
     signal.signal(signal.SIGINT, handle_exit)
     signal.signal(signal.SIGTERM, handle_exit)
 
-    while not stop_requested:
-        logger.info(f"--- Cycle {cycle_num} ---")
-        run_simulation_cycle(cycle_num)
-        cycle_num += 1
-        time.sleep(SIMULATION_INTERVAL)
-
+    # The assigner runs on a background worker so a slow assignment never
+    # delays the next cycle; leads it misses are picked up by a later run.
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="assigner") as executor:
+        assignment = None
+        while not stop_requested:
+            logger.info(f"--- Cycle {cycle_num} ---")
+            run_simulation_cycle(cycle_num)
+            if assignment is None or assignment.done():
+                assignment = executor.submit(assigner.assign_leads)
+            cycle_num += 1
+            time.sleep(SIMULATION_INTERVAL)
+
+    assigner.POOL.closeall()
     logger.info("Lead simulator stopped.")
 
 if __name__ == "__main__":